@@ -4,29 +4,251 @@ Task Scheduler for Android Server
 Schedule and automate tasks on Android server
 """
 
-import json
-import time
-import schedule
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import mmap
+import os
+import re
+import shlex
+import shutil
+import signal
 import subprocess
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 
+import orjson
+
+# Anything the shell would have to interpret (pipes, globs, expansions, ~, VAR=...)
+SHELL_META = re.compile(r"[|&;<>()$`\\*?\[\]{}~#!\n]|^\s*\w+=")
+
+# subprocess only takes its posix_spawn path for an absolute executable with
+# close_fds=False, and only where libc supports it (glibc >= 2.24, macOS).
+# Elsewhere, e.g. Termux's Bionic, keep the default fd closing.
+SPAWN_OPTS = {"close_fds": False} if getattr(subprocess, "_USE_POSIX_SPAWN", False) else {}
+
+@functools.lru_cache(maxsize=None)
+def _which(name):
+    """Resolve a program name to an absolute path once"""
+    return shutil.which(name) or name
+
+# Longest single sleep in seconds. Loop time stops while an Android phone
+# is suspended, so wall time is re-checked at least this often.
+WALL_CLOCK_RECHECK = 60.0
+
+# Seconds to wait before writing tasks.json, so bursts of saves coalesce
+SAVE_DELAY = 1.0
+
+# Compact the last-run journal into tasks.json once it grows past this
+JOURNAL_MAX_BYTES = 1 << 20
+
+# Parsed task files: path -> (st_mtime_ns, st_size, tasks)
+_TASKS_CACHE = {}
+
+# What a task with missing or wrongly typed fields raises while compiling
+TASK_ERRORS = (KeyError, ValueError, TypeError, AttributeError)
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+def _parse_time(text):
+    """Parse a time of day given as HH:MM or HH:MM:SS"""
+    try:
+        return datetime.strptime(text, "%H:%M")
+    except ValueError:
+        return datetime.strptime(text, "%H:%M:%S")
+
+def _compile_schedule(task):
+    """Turn a task's schedule spec into a function mapping now to its next fire"""
+    schedule_type = task['schedule_type']
+    schedule_time = task['schedule_time']
+    
+    if schedule_type == "interval":
+        every = timedelta(minutes=int(schedule_time))
+        if every <= timedelta(0):
+            raise ValueError("interval must be at least 1 minute")
+        return lambda now: now + every
+    elif schedule_type == "hourly":
+        minute = int(schedule_time)
+        if not 0 <= minute <= 59:
+            raise ValueError("minute must be in 0..59")
+        align = lambda now: now.replace(minute=minute, second=0, microsecond=0)
+        step = timedelta(hours=1)
+    elif schedule_type == "daily":
+        at = _parse_time(schedule_time)
+        align = lambda now: now.replace(hour=at.hour, minute=at.minute, second=at.second, microsecond=0)
+        step = timedelta(days=1)
+    elif schedule_type == "weekly":
+        day, time_str = schedule_time.split()
+        weekday = WEEKDAYS.index(day.lower())
+        at = _parse_time(time_str)
+        align = lambda now: (
+            now.replace(hour=at.hour, minute=at.minute, second=at.second, microsecond=0)
+            + timedelta(days=(weekday - now.weekday()) % 7)
+        )
+        step = timedelta(weeks=1)
+    else:
+        raise ValueError(f"Unknown schedule type: {schedule_type}")
+    
+    def next_fire(now):
+        fire = align(now)
+        return fire if fire > now else fire + step
+    return next_fire
+
+def _command_argv(command):
+    """Split a command for direct exec, or return None if it needs a shell"""
+    if SHELL_META.search(command):
+        return None
+    argv = shlex.split(command)
+    if not argv:
+        raise ValueError("empty command")
+    return [_which(argv[0])] + argv[1:]
+
 class TaskScheduler:
-    def __init__(self, config_file="tasks.json"):
+    def __init__(self, config_file="tasks.json", max_parallel=None):
         self.config_file = Path(config_file)
+        # Append-only "name\tlast_run" lines, so a finished job doesn't
+        # rewrite the whole of tasks.json
+        self.journal_file = self.config_file.with_suffix(".last_run.log")
+        self._journal = None
         self.tasks = self.load_tasks()
+        self._load_journal()
+        # Cap on tasks running at once, so a burst of jobs can't exhaust a phone
+        self.max_parallel = max_parallel or min(4, os.cpu_count() or 1)
+        self._active = 0
+        # Jobs waiting for a slot: (-priority, arrival order, future)
+        self._waiting = []
+        self._arrivals = itertools.count()
+        self._running = False
+        self._dirty = False
+        self._flush_handle = None
+        # Per running task: compiled schedule and argv, indexed like the heap
+        self._task_meta = []
+        # (wall-clock fire timestamp, index into _task_meta)
+        self._heap = []
+        self._jobs = {}
+        self._wakeup = None
         
     def load_tasks(self):
-        """Load tasks from config file"""
-        if self.config_file.exists():
-            with open(self.config_file, 'r') as f:
-                return json.load(f)
-        return []
+        """Load tasks from config file, reusing the last parse if unchanged"""
+        try:
+            st = self.config_file.stat()
+        except FileNotFoundError:
+            return []
+        
+        key = str(self.config_file)
+        cached = _TASKS_CACHE.get(key)
+        if cached is None or cached[:2] != (st.st_mtime_ns, st.st_size):
+            with open(self.config_file, 'rb') as f:
+                if st.st_size == 0:
+                    tasks = orjson.loads(f.read())
+                else:
+                    # orjson parses straight from the mapping, no bytes copy
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        with memoryview(mm) as view:
+                            tasks = orjson.loads(view)
+            cached = (st.st_mtime_ns, st.st_size, tasks)
+            _TASKS_CACHE[key] = cached
+        # Tasks are flat dicts, so copying each one keeps the cache pristine;
+        # anything else is left for _compile_task() to report
+        return [dict(task) if isinstance(task, dict) else task for task in cached[2]]
     
     def save_tasks(self):
-        """Save tasks to config file"""
-        with open(self.config_file, 'w') as f:
-            json.dump(self.tasks, f, indent=2)
+        """Save tasks to config file, coalescing saves made within SAVE_DELAY"""
+        self._dirty = True
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._flush()
+            return
+        self._flush_handle = loop.call_later(SAVE_DELAY, self._flush)
+    
+    def _flush(self):
+        """Write pending task changes to disk atomically"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._dirty:
+            return
+        self._dirty = False
+        
+        tmp = self.config_file.with_suffix(".json.tmp")
+        tmp.write_bytes(orjson.dumps(self.tasks, option=orjson.OPT_INDENT_2))
+        os.replace(tmp, self.config_file)
+        st = self.config_file.stat()
+        _TASKS_CACHE[str(self.config_file)] = (
+            st.st_mtime_ns, st.st_size,
+            [dict(task) if isinstance(task, dict) else task for task in self.tasks]
+        )
+    
+    def _disk_changed(self):
+        """Return True if tasks.json differs from what we last read or wrote"""
+        try:
+            st = self.config_file.stat()
+        except FileNotFoundError:
+            return False
+        cached = _TASKS_CACHE.get(str(self.config_file))
+        return cached is None or cached[:2] != (st.st_mtime_ns, st.st_size)
+    
+    def _load_journal(self, tasks=None):
+        """Apply the newest journal entry for each task to its last_run"""
+        if tasks is None:
+            tasks = self.tasks
+        try:
+            f = open(self.journal_file, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            by_name = {task.get('name'): task for task in tasks if isinstance(task, dict)}
+            seen = set()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # Walk lines newest first, stopping once every task is known
+                end = len(mm)
+                while end > 0 and len(seen) < len(by_name):
+                    start = mm.rfind(b"\n", 0, end - 1) + 1
+                    name, sep, ts = mm[start:end].rstrip(b"\n").rpartition(b"\t")
+                    end = start
+                    name = name.decode(errors='replace')
+                    if sep and name in by_name and name not in seen:
+                        by_name[name]['last_run'] = ts.decode()
+                        seen.add(name)
+    
+    def _record_run(self, task):
+        """Append a task's last_run to the journal"""
+        # After a reload the job's task dict is no longer in self.tasks, so
+        # copy the time onto the current task of the same name
+        for current in self.tasks:
+            if (current is not task and isinstance(current, dict)
+                    and current.get('name') == task['name']):
+                current['last_run'] = task['last_run']
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'ab', buffering=0)
+        self._journal.write(f"{task['name']}\t{task['last_run']}\n".encode())
+        if self._journal.tell() > JOURNAL_MAX_BYTES:
+            self._compact()
+    
+    def _compact(self):
+        """Fold journalled run times into tasks.json and empty the journal"""
+        if self._journal is None:
+            if not self.journal_file.exists():
+                self._flush()
+                return
+            self._journal = open(self.journal_file, 'ab', buffering=0)
+        if self._journal.tell() > 0:
+            if self._disk_changed():
+                # tasks.json was edited by hand since we read it; keep those
+                # edits and apply the journalled run times on top
+                self.tasks = self.load_tasks()
+                self._load_journal()
+            self._dirty = True
+        self._flush()
+        self._journal.truncate(0)
+        self._journal.seek(0)
     
     def add_task(self, name, command, schedule_type, schedule_time):
         """Add a new scheduled task"""
@@ -40,54 +262,235 @@ class TaskScheduler:
         }
         self.tasks.append(task)
         self.save_tasks()
-        self.schedule_task(task)
+        if self._running:
+            self.schedule_task(task)
         
     def schedule_task(self, task):
-        """Schedule a task based on its config"""
-        def job():
-            print(f"[{datetime.now()}] Running task: {task['name']}")
+        """Compile a task's schedule and command and queue its first fire
+        
+        Only does anything while the scheduler is running; run() queues
+        every enabled task in self.tasks itself. Returns False otherwise.
+        """
+        if not self._running:
+            return False
+        compiled = self._compile_task(task)
+        if compiled is None:
+            return False
+        meta, first_fire = compiled
+        idx = len(self._task_meta)
+        self._task_meta.append(meta)
+        heapq.heappush(self._heap, (first_fire, idx))
+        self._wakeup.set()
+        return True
+    
+    def _compile_task(self, task):
+        """Return (meta, first fire) for a task, or None if it is invalid"""
+        try:
+            meta = {
+                "task": task,
+                "next_fn": _compile_schedule(task),
+                "argv": _command_argv(task['command']),
+                "priority": int(task.get('priority', 0)),
+                "log": logging.getLogger(f"task.{task['name']}")
+            }
+            meta['fire'] = meta['next_fn'](datetime.now())
+            return meta, meta['fire'].timestamp()
+        except TASK_ERRORS as e:
+            name = task.get('name') if isinstance(task, dict) else task
+            print(f"Invalid task {name}: {e}")
+            return None
+    
+    def _compile_all(self, tasks):
+        """Compile all enabled tasks into a new (task_meta, heap) pair
+        
+        Invalid tasks are reported and skipped. Nothing on self changes, so
+        a caller can keep the current schedule if anything goes wrong.
+        """
+        task_meta = []
+        heap = []
+        for task in tasks:
+            if isinstance(task, dict) and not task.get('enabled', True):
+                continue
+            compiled = self._compile_task(task)
+            if compiled is None:
+                continue
+            meta, first_fire = compiled
+            heap.append((first_fire, len(task_meta)))
+            task_meta.append(meta)
+            print(f"Scheduled: {task['name']}")
+        heapq.heapify(heap)
+        return task_meta, heap
+    
+    def _advance(self, idx, now):
+        """Move a task on to its next fire and return it as a timestamp
+        
+        The next fire follows the one just due rather than now, so interval
+        tasks don't drift. Fires missed while the phone slept are skipped.
+        """
+        meta = self._task_meta[idx]
+        fire = meta['next_fn'](meta['fire'])
+        if fire <= now:
+            fire = meta['next_fn'](now)
+        meta['fire'] = fire
+        return fire.timestamp()
+    
+    def _reload_tasks(self):
+        """Reload tasks.json (sent SIGHUP) and rebuild the schedule"""
+        print("Reloading tasks...")
+        # Parse and compile first, so a bad file leaves everything as it was
+        try:
+            tasks = self.load_tasks()
+            # Run times not yet compacted into tasks.json are in the journal
+            self._load_journal(tasks)
+            task_meta, heap = self._compile_all(tasks)
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Reload failed, keeping the current schedule: {e}")
+            return
+        
+        # The file on disk wins over unsaved edits
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._dirty = False
+        self.tasks = tasks
+        self._task_meta, self._heap = task_meta, heap
+        self._wakeup.set()
+    
+    def _start_job(self, idx):
+        """Run a due task in the background unless it is still running"""
+        name = self._task_meta[idx]['task']['name']
+        # Keyed by name so a job still counts as running across a reload
+        if name in self._jobs:
+            print(f"Task {name} is still running, skipping this run")
+            return
+        job = asyncio.create_task(self._run(idx))
+        self._jobs[name] = job
+        job.add_done_callback(lambda _: self._jobs.pop(name, None))
+    
+    async def _acquire_slot(self, priority):
+        """Wait for a free run slot; higher priority waiters are served first"""
+        if self._active < self.max_parallel and not self._waiting:
+            self._active += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (-priority, next(self._arrivals), waiter))
+        try:
+            # _release_slot() hands its slot straight to us
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            raise
+    
+    def _release_slot(self):
+        """Give a finished job's slot to the highest priority waiter"""
+        while self._waiting:
+            _, _, waiter = heapq.heappop(self._waiting)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+    
+    async def _spawn(self, meta):
+        """Start a task's command, only going through /bin/sh when it needs a shell"""
+        # argv[0] is already absolute, so SPAWN_OPTS is all posix_spawn needs
+        opts = dict(stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, **SPAWN_OPTS)
+        if meta['argv'] is None:
+            return await asyncio.create_subprocess_shell(meta['task']['command'], **opts)
+        return await asyncio.create_subprocess_exec(*meta['argv'], **opts)
+    
+    async def _pump(self, stream, emit):
+        """Pass a stream to emit() line by line as the process produces it"""
+        while True:
             try:
-                result = subprocess.run(
-                    task['command'],
-                    shell=True,
-                    capture_output=True,
-                    text=True
-                )
-                print(f"Output: {result.stdout}")
-                if result.stderr:
-                    print(f"Error: {result.stderr}")
-                task['last_run'] = datetime.now().isoformat()
-                self.save_tasks()
-            except Exception as e:
-                print(f"Error running task {task['name']}: {e}")
+                line = await stream.readuntil(b'\n')
+            except asyncio.IncompleteReadError as e:
+                # Output ended without a trailing newline
+                if e.partial:
+                    emit(e.partial.decode(errors='replace').rstrip())
+                break
+            except asyncio.LimitOverrunError as e:
+                # Line longer than the stream limit; pass it on in pieces
+                # rather than dropping it
+                line = await stream.readexactly(e.consumed)
+                emit(line.decode(errors='replace').rstrip() + " [line continues]")
+                continue
+            emit(line.decode(errors='replace').rstrip())
+    
+    async def _run(self, idx):
+        """Run a task's command and record when it ran"""
+        meta = self._task_meta[idx]
+        task = meta['task']
+        log = meta['log']
+        if self._active >= self.max_parallel:
+            log.info("Waiting for a free run slot")
+        await self._acquire_slot(meta['priority'])
+        log.info("Running task")
+        try:
+            proc = await self._spawn(meta)
+            await asyncio.gather(
+                self._pump(proc.stdout, log.info),
+                self._pump(proc.stderr, log.warning)
+            )
+            code = await proc.wait()
+            if code != 0:
+                log.error("Exited with code %d", code)
+            task['last_run'] = datetime.now().isoformat()
+            self._record_run(task)
+        except Exception as e:
+            log.error("Error running task: %s", e)
+        finally:
+            self._release_slot()
+    
+    async def _serve(self):
+        """Sleep until the earliest due task, fire it, and reschedule it"""
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._running = True
+        self._task_meta, self._heap = self._compile_all(self.tasks)
+        if not self._heap:
+            print("No enabled tasks to schedule")
         
-        schedule_type = task['schedule_type']
-        schedule_time = task['schedule_time']
+        # Reload on SIGHUP rather than polling tasks.json for changes
+        reload_signal = getattr(signal, "SIGHUP", None)
+        try:
+            loop.add_signal_handler(reload_signal, self._reload_tasks)
+        except (TypeError, NotImplementedError):
+            reload_signal = None
         
-        if schedule_type == "interval":
-            schedule.every(int(schedule_time)).minutes.do(job)
-        elif schedule_type == "hourly":
-            schedule.every().hour.at(f":{schedule_time}").do(job)
-        elif schedule_type == "daily":
-            schedule.every().day.at(schedule_time).do(job)
-        elif schedule_type == "weekly":
-            day, time_str = schedule_time.split()
-            getattr(schedule.every(), day.lower()).at(time_str).do(job)
+        try:
+            while True:
+                self._wakeup.clear()
+                now = datetime.now()
+                if self._heap and self._heap[0][0] <= now.timestamp():
+                    _, idx = self._heap[0]
+                    heapq.heapreplace(self._heap, (self._advance(idx, now), idx))
+                    self._start_job(idx)
+                    continue
+                
+                # Wake at the next deadline, early when add_task() or a
+                # reload queues something new, and now and then to catch
+                # up on wall time that passed while the phone slept
+                timeout = None
+                if self._heap:
+                    timeout = min(self._heap[0][0] - now.timestamp(), WALL_CLOCK_RECHECK)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if reload_signal is not None:
+                loop.remove_signal_handler(reload_signal)
+            self._running = False
+            self._compact()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
     
     def run(self):
         """Run the scheduler"""
         print("Task Scheduler started...")
-        
-        # Schedule all enabled tasks
-        for task in self.tasks:
-            if task.get('enabled', True):
-                self.schedule_task(task)
-                print(f"Scheduled: {task['name']}")
-        
-        # Run scheduler loop
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        asyncio.run(self._serve())
 
 # Example tasks configuration
 EXAMPLE_TASKS = [
@@ -118,14 +521,16 @@ EXAMPLE_TASKS = [
 ]
 
 if __name__ == "__main__":
-    scheduler = TaskScheduler()
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(name)s: %(message)s")
     
-    # Create example tasks file if not exists
+    # Create example tasks file if not exists, before loading it; the
+    # examples are only encoded on this first run
     if not Path("tasks.json").exists():
-        with open("tasks.json", 'w') as f:
-            json.dump(EXAMPLE_TASKS, f, indent=2)
+        Path("tasks.json").write_bytes(orjson.dumps(EXAMPLE_TASKS, option=orjson.OPT_INDENT_2))
         print("Created example tasks.json")
     
+    scheduler = TaskScheduler()
+    
     try:
         scheduler.run()
     except KeyboardInterrupt:
@@ -49,7 +49,7 @@ if [ "$PLATFORM" = "android" ]; then
         pip install -r requirements.txt
     else
         # Fallback to individual installs
-        pip install flask onnxruntime numpy requests schedule
+        pip install flask onnxruntime numpy requests orjson
     fi
     
     echo ""
@@ -87,16 +87,6 @@ else
     npm install
     cd ..
     
-    # Install Python dependencies (optional)
-    echo "Installing Python dependencies..."
-    if command -v pip3 >/dev/null 2>&1; then
-        pip3 install schedule || echo "Note: Python schedule module not installed (optional)"
-    elif command -v pip >/dev/null 2>&1; then
-        pip install schedule || echo "Note: Python schedule module not installed (optional)"
-    else
-        echo "Note: pip not found. Python automation features will require manual installation of 'schedule' module"
-    fi
-    
     # Make scripts executable
     echo "Setting up scripts..."
     chmod +x setup/pc/pc-client.py
@@ -17,6 +17,7 @@ pkg upgrade -y
 echo "[2/8] Installing essential packages..."
 pkg install -y \
     openssh \
+    rsync \
     python \
     nodejs \
     git \
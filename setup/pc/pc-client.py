@@ -4,35 +4,152 @@ Android Server Control Panel - PC Client
 Remote management interface for Android server
 """
 
+import os
 import subprocess
 import sys
 import json
-import argparse
+import functools
+import shlex
+import shutil
 from pathlib import Path
+from types import SimpleNamespace
+
+SYSTEM_INFO_SCRIPT = "~/server/scripts/system-info.sh"
+SERVICE_MANAGER_SCRIPT = "~/server/scripts/service-manager.sh"
+SERVICE_ACTIONS = ["start", "stop", "status"]
+
+# Positional arguments of each subcommand, in order; batch takes one or more steps
+CMDS = {
+    "info": (),
+    "service": ("action",),
+    "batch": ("steps",),
+    "deploy": ("local", "remote"),
+    "fetch": ("remote", "local"),
+    "monitor": (),
+    "shell": (),
+}
+
+# Separates per-command results in run_many() output (ASCII record separator)
+RECORD_SEP = "\x1e"
+
+# subprocess only takes its posix_spawn path for an absolute executable with
+# close_fds=False, and only where libc supports it (glibc >= 2.24, macOS)
+SPAWN_OPTS = {"close_fds": False} if getattr(subprocess, "_USE_POSIX_SPAWN", False) else {}
+
+@functools.lru_cache(maxsize=None)
+def _which(name):
+    """Resolve a program name to an absolute path once"""
+    return shutil.which(name) or name
+
+def run_command(argv, **kwargs):
+    """subprocess.run() that uses posix_spawn where the platform allows it"""
+    # Python's own fds are non-inheritable, so close_fds=False leaks nothing
+    return subprocess.run([_which(argv[0])] + list(argv[1:]), **SPAWN_OPTS, **kwargs)
+
+def quote_remote_path(path):
+    """Quote a remote path for the shell, leaving a leading ~/ free to expand"""
+    if path == "~" or path.startswith("~/"):
+        return "~/" + shlex.quote(path[2:]) if path[2:] else "~"
+    return shlex.quote(path)
+
+def remote_step(step):
+    """Map a batch step ("info", "service status", or a raw command) to a remote command"""
+    words = step.split()
+    if words == ["info"]:
+        return SYSTEM_INFO_SCRIPT
+    if len(words) == 2 and words[0] == "service" and words[1] in SERVICE_ACTIONS:
+        return f"{SERVICE_MANAGER_SCRIPT} {words[1]}"
+    return step
 
 class AndroidServerClient:
-    def __init__(self, host, port=8022, user=None):
+    def __init__(self, host, port=8022, user=None, use_rsync=None):
         self.host = host
         self.port = port
         self.user = user or "u0_a"
+        # rsync only sends changed blocks; None means use it if both ends have it
+        self.use_rsync = use_rsync
+        self._ctl_path = os.path.expanduser(f"~/.ssh/nps-{self.user}@{self.host}-{self.port}.sock")
+        self._master_started = False
+        
+    def _ensure_master(self):
+        """Start a background SSH ControlMaster the first time one is needed"""
+        if self._master_started or os.path.exists(self._ctl_path):
+            return
+        self._master_started = True
+        # -f returns once authenticated; if this fails, ControlMaster=auto
+        # below just makes each command connect on its own as before
+        try:
+            os.makedirs(os.path.dirname(self._ctl_path), mode=0o700, exist_ok=True)
+            run_command([
+                "ssh", "-M", "-N", "-f",
+                "-o", f"ControlPath={self._ctl_path}",
+                "-o", "ControlPersist=60s",
+                "-p", str(self.port),
+                f"{self.user}@{self.host}"
+            ], stdout=subprocess.DEVNULL)
+        except OSError:
+            pass
+    
+    def _ssh_options(self):
+        """Options that multiplex ssh/scp over the shared master connection"""
+        self._ensure_master()
+        return ["-o", f"ControlPath={self._ctl_path}", "-o", "ControlMaster=auto"]
         
     def ssh_command(self, command):
         """Execute command on Android server via SSH"""
         ssh_cmd = [
             "ssh",
+            *self._ssh_options(),
             "-p", str(self.port),
             f"{self.user}@{self.host}",
             command
         ]
         try:
-            result = subprocess.run(ssh_cmd, capture_output=True, text=True)
+            result = run_command(ssh_cmd, capture_output=True, text=True)
             return result.stdout, result.stderr, result.returncode
         except Exception as e:
             return "", str(e), 1
     
+    def run_many(self, commands):
+        """Execute several commands in a single SSH round-trip
+        
+        Returns one (stdout, stderr, returncode) tuple per command.
+        """
+        # After each command, write a separator to both streams and its exit
+        # code between two separators on stdout, so the output can be split.
+        # Each command runs in a subshell so an exit only ends that step.
+        script = "\n".join(
+            f"(\n{command}\n)\nprintf '\\036%d\\036' $?\nprintf '\\036' >&2"
+            for command in commands
+        )
+        stdout, stderr, code = self.ssh_command(script)
+        out_parts = stdout.split(RECORD_SEP)
+        err_parts = stderr.split(RECORD_SEP)
+        
+        results = []
+        for i in range(len(commands)):
+            try:
+                out, returncode = out_parts[2 * i], int(out_parts[2 * i + 1])
+            except (IndexError, ValueError):
+                # The batch stopped early (e.g. the connection dropped)
+                out, returncode = "", code or 1
+            err = err_parts[i] if i < len(err_parts) else ""
+            results.append((out, err, returncode))
+        return results
+    
+    def batch(self, steps):
+        """Run several steps on Android server over one connection"""
+        results = self.run_many([remote_step(step) for step in steps])
+        for step, (stdout, stderr, code) in zip(steps, results):
+            print(f"=== {step} ===")
+            if code == 0:
+                print(stdout)
+            else:
+                print(f"Error: {stderr}")
+    
     def get_system_info(self):
         """Get system information from Android server"""
-        stdout, stderr, code = self.ssh_command("~/server/scripts/system-info.sh")
+        stdout, stderr, code = self.ssh_command(SYSTEM_INFO_SCRIPT)
         if code == 0:
             print(stdout)
         else:
@@ -40,36 +157,83 @@ class AndroidServerClient:
     
     def service_control(self, action):
         """Control services on Android server"""
-        stdout, stderr, code = self.ssh_command(f"~/server/scripts/service-manager.sh {action}")
+        stdout, stderr, code = self.ssh_command(f"{SERVICE_MANAGER_SCRIPT} {action}")
         if code == 0:
             print(stdout)
         else:
             print(f"Error: {stderr}")
     
-    def deploy_file(self, local_path, remote_path):
-        """Deploy file to Android server"""
-        scp_cmd = [
-            "scp",
-            "-P", str(self.port),
-            local_path,
-            f"{self.user}@{self.host}:{remote_path}"
+    def _rsync_available(self):
+        """Check once whether rsync is installed on the PC and on the phone"""
+        if self.use_rsync is None:
+            self.use_rsync = (
+                _which("rsync") != "rsync"
+                and self.ssh_command("command -v rsync")[2] == 0
+            )
+        return self.use_rsync
+    
+    def _rsync_command(self, source, dest):
+        """rsync invocation that tunnels over the shared SSH connection"""
+        rsh = shlex.join(["ssh", *self._ssh_options(), "-p", str(self.port)])
+        return ["rsync", "-a", "--partial", "-e", rsh, source, dest]
+    
+    def _deploy_tree(self, local_dir, remote_dir):
+        """Stream a directory to Android server as one tar archive over SSH"""
+        target = quote_remote_path(remote_dir)
+        ssh_cmd = [
+            "ssh",
+            *self._ssh_options(),
+            "-p", str(self.port),
+            f"{self.user}@{self.host}",
+            f"mkdir -p {target} && tar -xf - -C {target}"
         ]
+        with subprocess.Popen([_which("tar"), "-cf", "-", "-C", local_dir, "."],
+                              stdout=subprocess.PIPE, **SPAWN_OPTS) as tar:
+            ssh = run_command(ssh_cmd, stdin=tar.stdout)
+        if tar.returncode != 0:
+            raise subprocess.CalledProcessError(tar.returncode, tar.args)
+        ssh.check_returncode()
+    
+    def deploy_file(self, local_path, remote_path):
+        """Deploy file or directory to Android server"""
+        is_dir = os.path.isdir(local_path)
         try:
-            subprocess.run(scp_cmd, check=True)
+            if self._rsync_available():
+                # A trailing slash makes rsync copy a directory's contents,
+                # matching the tar fallback
+                source = os.path.join(local_path, "") if is_dir else local_path
+                run_command(self._rsync_command(source, f"{self.user}@{self.host}:{remote_path}"),
+                            check=True)
+            elif is_dir:
+                self._deploy_tree(local_path, remote_path)
+            else:
+                scp_cmd = [
+                    "scp",
+                    *self._ssh_options(),
+                    "-P", str(self.port),
+                    local_path,
+                    f"{self.user}@{self.host}:{remote_path}"
+                ]
+                run_command(scp_cmd, check=True)
             print(f"Deployed {local_path} to {remote_path}")
         except subprocess.CalledProcessError as e:
             print(f"Error deploying file: {e}")
     
     def fetch_file(self, remote_path, local_path):
         """Fetch file from Android server"""
-        scp_cmd = [
-            "scp",
-            "-P", str(self.port),
-            f"{self.user}@{self.host}:{remote_path}",
-            local_path
-        ]
+        source = f"{self.user}@{self.host}:{remote_path}"
+        if self._rsync_available():
+            fetch_cmd = self._rsync_command(source, local_path)
+        else:
+            fetch_cmd = [
+                "scp",
+                *self._ssh_options(),
+                "-P", str(self.port),
+                source,
+                local_path
+            ]
         try:
-            subprocess.run(scp_cmd, check=True)
+            run_command(fetch_cmd, check=True)
             print(f"Fetched {remote_path} to {local_path}")
         except subprocess.CalledProcessError as e:
             print(f"Error fetching file: {e}")
@@ -79,12 +243,13 @@ class AndroidServerClient:
         print("Starting monitoring (Ctrl+C to stop)...")
         ssh_cmd = [
             "ssh",
+            *self._ssh_options(),
             "-p", str(self.port),
             f"{self.user}@{self.host}",
             "htop"
         ]
         try:
-            subprocess.run(ssh_cmd)
+            run_command(ssh_cmd)
         except KeyboardInterrupt:
             print("\nMonitoring stopped")
     
@@ -92,16 +257,22 @@ class AndroidServerClient:
         """Open interactive SSH shell"""
         ssh_cmd = [
             "ssh",
+            *self._ssh_options(),
             "-p", str(self.port),
             f"{self.user}@{self.host}"
         ]
-        subprocess.run(ssh_cmd)
+        run_command(ssh_cmd)
 
-def main():
+@functools.lru_cache(maxsize=1)
+def _build_parser():
+    """Build the command line parser once; parse_args() leaves it reusable"""
+    # Only needed for --help and usage errors, so keep it off the fast path
+    import argparse
     parser = argparse.ArgumentParser(description="Android Server Control Client")
     parser.add_argument("host", help="Android server IP address")
     parser.add_argument("-p", "--port", type=int, default=8022, help="SSH port (default: 8022)")
     parser.add_argument("-u", "--user", help="SSH username")
+    parser.add_argument("--no-rsync", action="store_true", help="Transfer files with scp/tar instead of rsync")
     
     subparsers = parser.add_subparsers(dest="command", help="Commands")
     
@@ -110,7 +281,12 @@ def main():
     
     # Service command
     service_parser = subparsers.add_parser("service", help="Control services")
-    service_parser.add_argument("action", choices=["start", "stop", "status"], help="Service action")
+    service_parser.add_argument("action", choices=SERVICE_ACTIONS, help="Service action")
+    
+    # Batch command
+    batch_parser = subparsers.add_parser("batch", help="Run several steps over one connection")
+    batch_parser.add_argument("steps", nargs="+",
+                              help='Steps such as info, "service status" or a remote command')
     
     # Deploy command
     deploy_parser = subparsers.add_parser("deploy", help="Deploy file to server")
@@ -128,18 +304,80 @@ def main():
     # Shell command
     subparsers.add_parser("shell", help="Open interactive shell")
     
-    args = parser.parse_args()
+    return parser
+
+def parse_args(argv):
+    """Parse the fixed pc-client grammar in a single pass
     
-    if not args.command:
-        parser.print_help()
-        return
+    Returns the same namespace argparse would, or None when the arguments
+    need argparse to handle them (help, abbreviations, usage errors).
+    """
+    args = SimpleNamespace(host=None, port=8022, user=None, no_rsync=False, command=None)
+    positional = []
+    rest = iter(argv)
+    for arg in rest:
+        if args.command is not None:
+            if arg.startswith("-"):
+                return None
+            positional.append(arg)
+        elif arg in ("-p", "--port", "-u", "--user"):
+            value = next(rest, None)
+            # argparse rejects option-looking values, so let it report them
+            if value is None or value.startswith("-"):
+                return None
+            if arg in ("-u", "--user"):
+                args.user = value
+            elif value.isascii() and value.isdigit():
+                args.port = int(value)
+            else:
+                return None
+        elif arg == "--no-rsync":
+            args.no_rsync = True
+        elif arg.startswith("-"):
+            return None
+        elif args.host is None:
+            args.host = arg
+        elif arg in CMDS:
+            args.command = arg
+        else:
+            return None
+    
+    if args.command is None:
+        return None
+    names = CMDS[args.command]
+    if args.command == "batch":
+        if not positional:
+            return None
+        args.steps = positional
+    elif len(positional) != len(names):
+        return None
+    else:
+        for name, value in zip(names, positional):
+            setattr(args, name, value)
+    if args.command == "service" and args.action not in SERVICE_ACTIONS:
+        return None
+    return args
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parse_args(argv)
+    if args is None:
+        parser = _build_parser()
+        args = parser.parse_args(argv)
+        if not args.command:
+            parser.print_help()
+            return
     
-    client = AndroidServerClient(args.host, args.port, args.user)
+    client = AndroidServerClient(args.host, args.port, args.user,
+                                 use_rsync=False if args.no_rsync else None)
     
     if args.command == "info":
         client.get_system_info()
     elif args.command == "service":
         client.service_control(args.action)
+    elif args.command == "batch":
+        client.batch(args.steps)
     elif args.command == "deploy":
         client.deploy_file(args.local, args.remote)
     elif args.command == "fetch":